@@ -26,8 +26,10 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import traceback
-import datetime
+import sys
+import linecache
+import functools
+import time
 import platform
 from enum import Enum
 from rich.console import Console
@@ -36,13 +38,52 @@ from rich.panel import Panel
 from rich.text import Text as RText
 
 
+# Last formatted local time and the second it belongs to
+LOCAL_TIME_CACHE = {'second': 0, 'local_time': ''}
+
+
 def get_local_time() -> str:
 	"""
-	Get local time
+	Get local time. It is formatted only once per second and reused by all
+	callers within that second.
 
 	:return: Local strftime (year-month-day hours:minutes:seconds)
 	"""
-	return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+	second = int(time.time())
+
+	if second != LOCAL_TIME_CACHE['second']:
+		LOCAL_TIME_CACHE['local_time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+		LOCAL_TIME_CACHE['second'] = second
+
+	return LOCAL_TIME_CACHE['local_time']
+
+
+def get_os_info() -> dict:
+	"""
+	Get information about the machine and operating system
+
+	:return: Dictionary with OS info
+	"""
+	os_info = {
+		'Machine': platform.machine(),
+		'Node': platform.node(),
+		'Proccessor': platform.processor(),
+		"OS": f'{platform.system()} {platform.release()} {platform.version()}'
+	}
+
+	try:
+		os_info.update(platform.freedesktop_os_release())
+	except OSError:
+		pass
+
+	return os_info
+
+
+# Collected once at import: platform probing reads /etc/os-release and must not run per exception
+OS_INFO = get_os_info()
+PYTHON_VERSION = platform.python_version()
+
+CONSOLE = Console()
 
 
 class ExceptionLevel(Enum):
@@ -68,59 +109,34 @@ class ExceptionCategory(Enum):
 	EXCEPTION_UNKNOWN_CATEGORY = "Unknown"
 
 
+LEVEL_EXPLAINATIONS = {
+	0: 'The exception is [blue]basic[/blue] in terms of criticality. The basic exception does [blue bold]not pose a danger[/blue bold] to the operation of the software.',
+	1: 'The exception is [cyan]uncritical[/cyan] in terms of criticality. The uncritical exception [cyan bold]does not pose a danger[/cyan bold] to the operation of the software, but it can [italic]provide useful information.[/italic]',
+	2: 'The exception is [yellow]warning[/yellow] in terms of criticality. The warning exception [yellow bold]does not pose a danger[/yellow bold] to the operation of the software, [italic]but the software may have a bug or problem.[/italic]',
+	3: 'The exception is [bold red]error[/bold red] in terms of criticality. The error exception [red bold]pose a danger[/red bold] to the operation of the software.',
+	4: 'The exception is [underline bold red]critical[/underline bold red] error in terms of criticality. The critical error exception [red underline bold]pose a serious danger[/red underlinebold] to the operation of the software.',
+}
+UNKNOWN_LEVEL_EXPLAINATION = "Unknown exception level in terms of criticality."
+
+CATEGORY_EXPLAINATIONS = {
+	ExceptionCategory.EXCEPTION_IO_CATEGORY.value: ' Category of exception: [underline bold]I/O (input/output)[/underline bold]. This type of exception occurs when there are problems [red italic]writing of reading data from disk.[/red italic]',
+	ExceptionCategory.EXCEPTION_THREAD_CATEGORY.value: ' Category of exception: [underline bold]Multithreading[/underline bold]. This type of exception occurs when there are problems working with [red italic]threads.[/red italic]',
+	ExceptionCategory.EXCEPTION_MODULE_CATEGORY.value: ' Category of exception: [underline bold]python module (or package)[/underline bold]. This type of exception occurs when there are problems with [red italic]python packages or modules.[/red italic]',
+	ExceptionCategory.EXCEPTION_CLASS_CATEGORY.value: ' Category of exception: [underline bold]python class object[/underline bold]. This type of exception occurs when there are problems with [red italic]python class objects.[/red italic]',
+	ExceptionCategory.EXCEPTION_NETWORK_CATEGORY.value: ' Category of exception: [underline bold]Network[/underline bold]. This type of exception occurs when there are problems with [red italic]network (sockets).[/red italic]',
+	ExceptionCategory.EXCEPTION_STDOUT_CATEGORY.value: ' Category of exception: [underline bold]STDOUT[/underline bold]. This type of exception occurs when there are problems with [red italic]stdout (subprocess commands output)[/red italic]',
+	ExceptionCategory.EXCEPTION_PERMISSION_CATEGORY.value: ' Category of exception: [underline bold]Permissions[/underline bold]. This type of exception occurs when there are problems with [red italic]permissions[/red italic].',
+	ExceptionCategory.EXCEPTION_UNKNOWN_CATEGORY.value: ' Category of exception: [underline bold]Unknown[/underline bold]. This type of exception occurs when there are [red italic]unknown[/red italic] problems.',
+	ExceptionCategory.EXCEPTION_GENERAL_CATEGORY.value: ' Category of exception: [bold]General[/bold]. This type of exception occurs when there are [red italic]general[/red italic] problems.[/italic]',
+}
+
+
+@functools.lru_cache(maxsize=64)
 def exception_explaination_by_errorcode(error_code: str) -> str:
-	ex_level = int(error_code.split(':::')[0].strip())
-	ex_category = error_code.split(':::')[1].strip()
-
-	explaination = ''
-
-	match ex_level:
-		case 0:
-			ex_level = ExceptionLevel.EXCEPTION_BASE_LEVEL
-			explaination = 'The exception is [blue]basic[/blue] in terms of criticality. The basic exception does [blue bold]not pose a danger[/blue bold] to the operation of the software.'
-		case 1:
-			ex_level = ExceptionLevel.EXCEPTION_WARNING_LEVEL
-			explaination = 'The exception is [cyan]uncritical[/cyan] in terms of criticality. The uncritical exception [cyan bold]does not pose a danger[/cyan bold] to the operation of the software, but it can [italic]provide useful information.[/italic]'
-		case 2:
-			ex_level = ExceptionLevel.EXCEPTION_UNCRITICAL_LEVEL
-			explaination = 'The exception is [yellow]warning[/yellow] in terms of criticality. The warning exception [yellow bold]does not pose a danger[/yellow bold] to the operation of the software, [italic]but the software may have a bug or problem.[/italic]'
-		case 3:
-			ex_level = ExceptionLevel.EXCEPTION_ERROR_LEVEL
-			explaination = 'The exception is [bold red]error[/bold red] in terms of criticality. The error exception [red bold]pose a danger[/red bold] to the operation of the software.'
-		case 4:
-			ex_level = ExceptionLevel.EXCEPTION_ERROR_LEVEL
-			explaination = 'The exception is [underline bold red]critical[/underline bold red] error in terms of criticality. The critical error exception [red underline bold]pose a serious danger[/red underlinebold] to the operation of the software.'
-		case _:
-			explaination = "Unknown exception level in terms of criticality."
-
-	match ex_category:
-		case "I/O":
-			ex_category = ExceptionCategory.EXCEPTION_IO_CATEGORY
-			explaination += ' Category of exception: [underline bold]I/O (input/output)[/underline bold]. This type of exception occurs when there are problems [red italic]writing of reading data from disk.[/red italic]'
-		case "Multithreading":
-			ex_category = ExceptionCategory.EXCEPTION_THREAD_CATEGORY
-			explaination += ' Category of exception: [underline bold]Multithreading[/underline bold]. This type of exception occurs when there are problems working with [red italic]threads.[/red italic]'
-		case "Python Module":
-			ex_category = ExceptionCategory.EXCEPTION_MODULE_CATEGORY
-			explaination += ' Category of exception: [underline bold]python module (or package)[/underline bold]. This type of exception occurs when there are problems with [red italic]python packages or modules.[/red italic]'
-		case "Class Object":
-			ex_category = ExceptionCategory.EXCEPTION_CLASS_CATEGORY
-			explaination += ' Category of exception: [underline bold]python class object[/underline bold]. This type of exception occurs when there are problems with [red italic]python class objects.[/red italic]'
-		case "Network (socket)":
-			ex_category = ExceptionCategory.EXCEPTION_NETWORK_CATEGORY
-			explaination += ' Category of exception: [underline bold]Network[/underline bold]. This type of exception occurs when there are problems with [red italic]network (sockets).[/red italic]'
-		case "STDOUT/STDERR (output)":
-			ex_category = ExceptionCategory.EXCEPTION_STDOUT_CATEGORY
-			explaination += ' Category of exception: [underline bold]STDOUT[/underline bold]. This type of exception occurs when there are problems with [red italic]stdout (subprocess commands output)[/red italic]'
-		case "Permission":
-			ex_category = ExceptionCategory.EXCEPTION_PERMISSION_CATEGORY
-			explaination += ' Category of exception: [underline bold]Permissions[/underline bold]. This type of exception occurs when there are problems with [red italic]permissions[/red italic].'
-		case "Unknown":
-			ex_category = ExceptionCategory.EXCEPTION_UNKNOWN_CATEGORY
-			explaination += ' Category of exception: [underline bold]Unknown[/underline bold]. This type of exception occurs when there are [red italic]unknown[/red italic] problems.'
-		case "General":
-			ex_category = ExceptionCategory.EXCEPTION_GENERAL_CATEGORY
-			explaination += ' Category of exception: [bold]General[/bold]. This type of exception occurs when there are [red italic]general[/red italic] problems.[/italic]'
+	ex_level, _, ex_category = error_code.partition(':::')
+
+	explaination = LEVEL_EXPLAINATIONS.get(int(ex_level.strip()), UNKNOWN_LEVEL_EXPLAINATION)
+	explaination += CATEGORY_EXPLAINATIONS.get(ex_category.strip(), '')
 
 	return explaination
 
@@ -137,16 +153,8 @@ class BaseException(Exception):
 		self.details = details
 		self.traceback_info = self.get_traceback()
 		self.timestamp = get_local_time()
-		self.python_version = platform.python_version()
-		self.os_info = {
-			'Machine': platform.machine(),
-			'Node': platform.node(),
-			'Proccessor': platform.processor(),
-			"OS": f'{platform.system()} {platform.release()} {platform.version()}'
-		}
-
-		for key, value in platform.freedesktop_os_release().items():
-			self.os_info[key] = value
+		self.python_version = PYTHON_VERSION
+		self.os_info = OS_INFO
 
 	def render_exception_info(self) -> Table:
 		table = Table(show_header=True, show_edge=True, padding=(0, 1))
@@ -166,12 +174,8 @@ class BaseException(Exception):
 		return table
 
 	def render_os_info(self) -> Panel:
-		info = ''
-
-		for key, value in self.os_info.items():
-			info += f'[bold]{key}[/bold]: {value}\n'
-
-		info += '[bold]GitHub repository[bold]: https://github.com/alxvdev/ovpn-traffic-monitor'
+		info = '\n'.join(f'[bold]{key}[/bold]: {value}' for key, value in self.os_info.items())
+		info += '\n[bold]GitHub repository[/bold]: https://github.com/alxvdev/ovpn-traffic-monitor'
 
 		return Panel(
 			info,
@@ -187,29 +191,37 @@ class BaseException(Exception):
 		)
 
 	def get_traceback(self):
-		tb = traceback.extract_stack()
-		frame = tb[0]
+		# First frame outside of this module is the place where the exception was created
+		frame = sys._getframe(1)
+		while frame.f_back is not None and frame.f_code.co_filename == __file__:
+			frame = frame.f_back
+
+		filename = frame.f_code.co_filename
+		lineno = frame.f_lineno
+		line = linecache.getline(filename, lineno).strip()
+
 		error_code = f"{self.exception_level.value}:::{self.exception_category.value}"
 		explaination = exception_explaination_by_errorcode(error_code)
-		return f'[italic]in [/italic][underline]{frame.filename}[/underline][italic] at [magenta]{frame.lineno}[/magenta]:[/italic]\n >>> [bold]{frame.line}[/bold]\n\nError code {error_code}: {explaination}'
+		return f'[italic]in [/italic][underline]{filename}[/underline][italic] at [magenta]{lineno}[/magenta]:[/italic]\n >>> [bold]{line}[/bold]\n\nError code {error_code}: {explaination}'
 
 	def __str__(self):
-		console = Console()
+		if self.exception_level.value >= 3:
+			# The process exits right away, a plain line is enough and much cheaper than rich panels
+			sys.stderr.write(f'{self.exception_id} L{self.exception_level.value}: {self.message} ({self.details}). Error code: {self.error_code}\n')
+			exit(1)
+
 		panel = Panel(
 			self.render_exception_info(),
 			title=f'[bold red]{self.exception_id} L{self.exception_level.value}: {self.exception_category.value}[/bold red]',
 			border_style='bold red'
 		)
 
-		console.print(panel)
-		console.print(self.render_os_info())
-		console.print(self.render_traceback_info())
+		CONSOLE.print(panel)
+		CONSOLE.print(self.render_os_info())
+		CONSOLE.print(self.render_traceback_info())
 
-		console.print(f'Error code: {self.error_code}')
+		CONSOLE.print(f'Error code: {self.error_code}')
 
-		if self.exception_level.value >= 3:
-			exit(1)
-		
 		return f"{self.exception_id}"
 
 
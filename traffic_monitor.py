@@ -26,20 +26,41 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from threading import Thread
+from threading import Thread, Lock, Event
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
+import tempfile
+import selectors
+import signal
+import stat
+import os
 import uuid
+import csv
+import re
 import json
-import datetime
+import time
 import argparse
+import functools
 import socket
+import ipaddress
 import logging
 from pathlib import Path
 from configparser import ConfigParser
-from rich import print
+from rich import print, get_console
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+try:
+	import ujson
+except ImportError:
+	ujson = None
 
 from modules.exceptions_logging import IOException, ThreadException, ClassObjectException
-from modules.exceptions_logging import ExceptionLevel
+from modules.exceptions_logging import ExceptionLevel, get_local_time
 
 LOGO = '''
 [blue]  ____              _   _____  _  __    [/blue][green bold]ovpn-traffic-monitor[/green bold]
@@ -49,31 +70,212 @@ LOGO = '''
 [blue]    /_/                                 [/blue][cyan]https://github.com/alxvdev/ovpn-traffic-monitor[/cyan]
 '''
 
+STATUS_CLIENT_LIST_HEADER = 'Virtual Address,Common Name,Real Address,Last Ref'
+STATUS_CLIENT_LIST_END = ['GLOBAL STATS']
+
+# tcpdump -n line: "<time> IP <src>.<port> > <dst>.<port>: ..." (ports are absent for ICMP)
+TCPDUMP_PACKET_RE = re.compile(rb'^\S+ IP (\d{1,3}(?:\.\d{1,3}){3})(?:\.\d+)? > (\d{1,3}(?:\.\d{1,3}){3})(?:\.\d+)?:')
+
+# Permissions of a newly created users file
+USERS_FILE_MODE = 0o644
+
+# Seconds between checks of the OpenVPN status file
+STATUS_POLL_INTERVAL = 1
+
+# Seconds between resolutions of monitoring sites given as hostnames (their addresses may rotate)
+SITES_RESOLVE_INTERVAL = 300
+
+# Seconds the capture dispatcher waits for tcpdump output before re-checking its stop event
+CAPTURE_POLL_INTERVAL = 0.2
+
+# Application logger: its level decides which messages are printed and logged
+LOGGER = logging.getLogger(__name__)
+
+# Message type -> (rich color, label, logging level)
+MESSAGE_LEVELS = {
+	'debug': ('blue', 'DEBUG', logging.DEBUG),
+	'info': ('green', 'INFO', logging.INFO),
+	'warning': ('yellow', 'WARNING', logging.WARNING),
+	'error': ('red', 'ERROR', logging.ERROR),
+	logging.DEBUG: ('blue', 'DEBUG', logging.DEBUG),
+	logging.INFO: ('green', 'INFO', logging.INFO),
+	logging.WARNING: ('yellow', 'WARNING', logging.WARNING),
+	logging.ERROR: ('red', 'ERROR', logging.ERROR),
+}
+
 
 def msg(msg_text: str, msg_type: str) -> str:
 	"""
-	Print message withour logging
+	Print message withour logging. Messages below the level of the application
+	logger are not printed (debug messages are shown only with --verbose).
 
 	:param msg_text: Text of message
 	:param msg_type: Type of message
 
 	:return: Message with rich formatting
 	"""
-	msg_type = msg_type.lower()
-	if msg_type == 'info' or msg_type == logging.INFO:
-		message = f'[green]{datetime.datetime.now()}::INFO[/green] -- {msg_text}'
-	elif msg_type == 'warning' or msg_type == logging.WARNING:
-		message = f'[yellow]{datetime.datetime.now()}::WARNING[/yellow] -- {msg_text}'
-	elif msg_type == 'error' or msg_type == logging.ERROR:
-		message = f'[red]{datetime.datetime.now()}::ERROR[/red] -- {msg_text}'
-	else:
-		message = f'[blue]{datetime.datetime.now()}::{msg_type.upper()}[/blue] -- {msg_text}'
+	color, label, level = MESSAGE_LEVELS.get(msg_type) or MESSAGE_LEVELS.get(str(msg_type).lower(), ('blue', str(msg_type).upper(), logging.INFO))
+	message = f'[{color}]{get_local_time()}::{label}[/{color}] -- {msg_text}'
+
+	if not LOGGER.isEnabledFor(level):
+		return message
 
-	print(message)
+	get_console().print(message, highlight=False)
 
 	return message
 
 
+def dump_json(data: dict) -> bytes:
+	"""
+	Serialize data to indented JSON (uses orjson or ujson if one of them is installed)
+
+	:param data: Data for serialization
+
+	:return: JSON document
+	"""
+	if orjson is not None:
+		return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+
+	if ujson is not None:
+		return ujson.dumps(data, indent=2).encode()
+
+	return json.dumps(data, indent=2).encode()
+
+
+class HostnameCache:
+	"""
+	LRU cache of resolved hostnames with expiration of entries
+	"""
+	def __init__(self, maxsize: int=4096, ttl: float=300, negative_ttl: float=60):
+		"""
+		HostnameCache initialization
+
+		:param maxsize: Maximum number of cached entries
+		:param ttl: Lifetime (in seconds) of resolved hostnames
+		:param negative_ttl: Lifetime (in seconds) of failed lookups
+		"""
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.entries: OrderedDict = OrderedDict()
+		self.lock = Lock()
+
+	def get(self, ip_address: str) -> str:
+		"""
+		Get cached hostname
+
+		:param ip_address: IP Address
+
+		:return: Hostname, N/A for failed lookups or None if there is no valid entry
+		"""
+		with self.lock:
+			entry = self.entries.get(ip_address)
+
+			# Expired entries are kept (until evicted), get_stale() serves them while they are refreshed
+			if entry is None or entry[0] < time.monotonic():
+				return None
+
+			self.entries.move_to_end(ip_address)
+			return entry[1]
+
+	def get_stale(self, ip_address: str) -> str:
+		"""
+		Get cached hostname even if its entry has expired
+
+		:param ip_address: IP Address
+
+		:return: Hostname, N/A for failed lookups or None if there is no entry
+		"""
+		with self.lock:
+			entry = self.entries.get(ip_address)
+
+			if entry is None:
+				return None
+
+			self.entries.move_to_end(ip_address)
+			return entry[1]
+
+	def put(self, ip_address: str, hostname: str) -> None:
+		"""
+		Cache hostname
+
+		:param ip_address: IP Address
+		:param hostname: Hostname or N/A for failed lookups
+		"""
+		ttl = self.negative_ttl if hostname == "N/A" else self.ttl
+
+		with self.lock:
+			self.entries[ip_address] = (time.monotonic() + ttl, hostname)
+			self.entries.move_to_end(ip_address)
+
+			if len(self.entries) > self.maxsize:
+				self.entries.popitem(last=False)
+
+
+HOSTNAME_CACHE = HostnameCache()
+
+
+def resolve_hostname(ip_address: str) -> str:
+	"""
+	Resolve hostname by ip address. Results (including failed lookups) are cached,
+	so repeated packets to the same server do not hit the resolver again.
+
+	:param ip_address: IP Address of server for resolving hostname
+
+	:return: Hostname or N/A
+	"""
+	hostname = HOSTNAME_CACHE.get(ip_address)
+
+	if hostname is not None:
+		return hostname
+
+	try:
+		hostname, aliaslist, ipaddrlist = socket.gethostbyaddr(ip_address)
+	except (socket.herror, socket.gaierror) as e:
+		LOGGER.warning('Error resolving hostname for IP Address %s: %s', ip_address, e)
+		hostname = "N/A"
+
+	HOSTNAME_CACHE.put(ip_address, hostname)
+
+	return hostname
+
+
+def resolve_monitoring_sites(sites: frozenset, previous: dict=None) -> dict:
+	"""
+	Convert monitoring sites (networks, IP addresses or hostnames) to networks.
+	Hostnames are resolved when the configuration is loaded and then again
+	every SITES_RESOLVE_INTERVAL seconds by TCPDumpManager.
+
+	:param sites: Monitoring sites from the configuration file
+	:param previous: Networks of every site from the last resolution, kept for a hostname that can not be resolved now
+
+	:return: Networks of every monitoring site (site -> frozenset of networks)
+	"""
+	previous = previous or {}
+	site_networks = {}
+
+	for site in sites:
+		try:
+			site_networks[site] = frozenset([ipaddress.ip_network(site, strict=False)])
+			continue
+		except ValueError:
+			pass
+
+		try:
+			hostname, aliaslist, ipaddrlist = socket.gethostbyname_ex(site)
+		except OSError as ex:
+			msg(f'Could not resolve monitoring site {site}: {ex}', 'warning')
+
+			if site in previous:
+				site_networks[site] = previous[site]
+
+			continue
+
+		site_networks[site] = frozenset(ipaddress.ip_network(address) for address in ipaddrlist)
+
+	return site_networks
+
+
 class Config:
 	"""
 	Holds the configuration for the application.
@@ -95,31 +297,68 @@ class Config:
 		self.USERS_JSON_FILE = self.config.get('PATHS', 'users_file')
 		self.TRAFFIC_LOG = self.config.get('PATHS', 'traffic_monitor_log')
 
-		print(f'OpenVPN Status File: {self.OPENVPN_STATUS_FILE}')
-		print(f'OpenVPN Users JSON Data: {self.USERS_JSON_FILE}')
-		print(f'User traffic log: {self.TRAFFIC_LOG}')
-
 		# Logging
 		self.LOG_FORMAT = "[%(asctime)s %(levelname)s] %(name)s -- %(message)s"
 		self.LOG_FILEPATH = self.config.get('LOGGING', 'log_file')
 
-		print(f'Plain logging format string: {self.LOG_FORMAT}')
-		print(f'Plain log filepath: {self.LOG_FILEPATH}')
-
 		# Monitor
 		self.NETWORK_INTERFACE = self.config.get('MONITOR', 'network_interface')
-		self.MONITORING_SITES = [site.strip() for site in self.config.get('MONITOR', 'monitoring_sites').split(',')]
+		self.MONITORING_SITES = frozenset(site.strip() for site in self.config.get('MONITOR', 'monitoring_sites').split(',') if site.strip())
+
+		self.MONITORING_SITE_NETWORKS = resolve_monitoring_sites(self.MONITORING_SITES)
+		self.MONITORING_NETWORKS = frozenset().union(*self.MONITORING_SITE_NETWORKS.values())
+
+		# Without networks the capture would not be limited to the monitoring sites at all
+		if self.MONITORING_SITES and not self.MONITORING_NETWORKS:
+			msg(f'None of the monitoring sites could be resolved: {", ".join(sorted(self.MONITORING_SITES))}', 'error')
+			exit(1)
+
+
+@functools.lru_cache(maxsize=1)
+def get_config(config_file: str='config.ini') -> Config:
+	"""
+	Get the process-wide Config object. The configuration file is read only once,
+	subsequent calls return the same object.
+
+	:param config_file: Path to the configuration file
 
-		print(f'Network interface of OpenVPN: {self.NETWORK_INTERFACE}')
-		print(f'Monitoring sites list: {self.MONITORING_SITES}')
+	:return: Config object
+	"""
+	return Config(config_file)
 
 
 class TrafficMonitorLogger:
 	"""
 	Responsible for logging website visits
 	"""
-	@staticmethod
-	def log_website_visit(traffic_log_filepath: str, real_ip: str, virtual_ip: str, user_uuid: str, website: str) -> None:
+	def __init__(self, traffic_log_filepath: str, flush_interval: float=0.2, batch_size: int=64):
+		"""
+		TrafficMonitorLogger initialization
+
+		:param traffic_log_filepath: Traffic log file path
+		:param flush_interval: Interval (in seconds) between background flushes
+		:param batch_size: Number of buffered entries that triggers an immediate flush
+		"""
+		self.traffic_log_filepath = traffic_log_filepath
+		self.flush_interval = flush_interval
+		self.batch_size = batch_size
+
+		self.buffer: deque = deque()
+		self.lock = Lock()
+		self.file = open(traffic_log_filepath, 'a', buffering=1 << 16)
+
+		self.closed = Event()
+		self.flusher = Thread(target=self._periodic_flush, name='traffic-log-flusher', daemon=True)
+		self.flusher.start()
+
+	def _periodic_flush(self) -> None:
+		"""
+		Flush the buffer every flush_interval seconds until the logger is closed
+		"""
+		while not self.closed.wait(self.flush_interval):
+			self.flush()
+
+	def log_website_visit(self, real_ip: str, virtual_ip: str, user_uuid: str, website: str) -> None:
 		"""
 		Log a website visit
 
@@ -128,31 +367,59 @@ class TrafficMonitorLogger:
 		:param user_uuid: Universal Unique Identifier
 		:param website: Website URL
 		"""
-		timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-		log_entry = f'[{timestamp}] {user_uuid} ({virtual_ip}/{real_ip}) visited the site {website}'
-		print(log_entry)
+		log_entry = f'[{get_local_time()}] {user_uuid} ({virtual_ip}/{real_ip}) visited the site {website}'
 
-		try:
-			with open(traffic_log_filepath, 'a') as file:
-				file.write(f'{log_entry}\n')
-		except Exception as ex:
-			IOException('Exception occured when reading config file (and log website visit)', f"Traffic log file: {traffic_log_filepath}. Error: {ex}", ExceptionLevel.EXCEPTION_WARNING_LEVEL)
+		with self.lock:
+			self.buffer.append(f'{log_entry}\n')
+			buffer_is_full = len(self.buffer) >= self.batch_size
+
+		if buffer_is_full:
+			self.flush()
+
+	def flush(self) -> None:
+		"""
+		Write buffered entries to the traffic log file
+		"""
+		with self.lock:
+			if not self.buffer or self.file.closed:
+				return
+
+			entries = ''.join(self.buffer)
+			self.buffer.clear()
+
+			try:
+				self.file.write(entries)
+				self.file.flush()
+			except Exception as ex:
+				IOException('Exception occured when writing traffic log (log website visit)', f"Traffic log file: {self.traffic_log_filepath}. Error: {ex}", ExceptionLevel.EXCEPTION_WARNING_LEVEL)
+
+	def close(self) -> None:
+		"""
+		Stop background flushing, flush the buffer and close the traffic log file
+		"""
+		self.closed.set()
+		self.flusher.join(timeout=2)
+		self.flush()
+
+		with self.lock:
+			self.file.close()
 
 
 class PlainLogger:
 	"""
 	Plain Logger system
 	"""
-	def __init__(self, logfilename: str, formatting: str):
+	def __init__(self, logfilename: str, formatting: str, level: int=logging.INFO):
 		"""
 		PlainLogger initialization
 
 		:param logfilename: Logfile path
 		:param formatting: Formatting string
+		:param level: Minimal logging level of messages
 		"""
 		self.logfilename = logfilename
-		self.logger = logging.getLogger(__name__)
-		self.logger.setLevel(logging.DEBUG)
+		self.logger = LOGGER
+		self.logger.setLevel(level)
 
 		handler = logging.FileHandler(logfilename, mode='w')
 		formatter = logging.Formatter(formatting)
@@ -160,6 +427,15 @@ class PlainLogger:
 		handler.setFormatter(formatter)
 		self.logger.addHandler(handler)
 
+		# Message type -> (logging level, logger method); other types are logged as info
+		self.dispatch = {
+			'DEBUG': (logging.DEBUG, self.logger.debug),
+			'INFO': (logging.INFO, self.logger.info),
+			'WARNING': (logging.WARNING, self.logger.warning),
+			'ERROR': (logging.ERROR, self.logger.error),
+		}
+		self.default_dispatch = self.dispatch['INFO']
+
 	def get_logger(self) -> logging.Logger:
 		"""
 		Get logger object
@@ -174,141 +450,295 @@ class PlainLogger:
 		:param message_type: Type of message (info, warning, error or other)
 		"""
 		message_type = message_type.upper()
+		level, log_method = self.dispatch.get(message_type, self.default_dispatch)
 
-		if message_type == logging.INFO or message_type == 'info':
-			msg(text, message_type)
-			self.logger.info(text)
-		if message_type == logging.WARNING or message_type == 'warning':
-			msg(text, message_type)
-			self.logger.warning(text)
-		if message_type == logging.ERROR or message_type == 'error':
-			msg(text, message_type)
-			self.logger.error(text)
-		else:
-			msg(text, message_type)
-			self.logger.info(text)
+		if not self.logger.isEnabledFor(level):
+			return
+
+		msg(text, message_type)
+		log_method('%s', text)
 
 
 class TCPDumpManager:
 	"""
-	Manages the tcpdump processes for monitoring user traffic
+	Manages the tcpdump process for monitoring user traffic.
+	A single tcpdump process captures the traffic of all monitored users,
+	packets are dispatched to users by their source (virtual) IP address.
+	The output of the capture is read by one long-lived dispatcher thread
+	through a selector, captures only register and unregister their pipe.
 	"""
-	def __init__(self, plain_logger: PlainLogger, config: Config):
+	def __init__(self, plain_logger: PlainLogger, config: Config, traffic_logger: TrafficMonitorLogger):
 		"""
 		Initialization TCPDump Manager
 
 		:param plain_logger: PlainLogger object
 		:param config: Config object
+		:param traffic_logger: TrafficMonitorLogger object
 		"""
-		self.active_processes: dict = {}
+		self.active_users: dict = {}
+		self.users_by_virtual_ip: dict = {}
+		self.capture: dict = {}
+		self.capture_lock = Lock()
 		self.logger = plain_logger
 		self.config = config
+		self.traffic_logger = traffic_logger
+		self.resolver = ThreadPoolExecutor(max_workers=8, thread_name_prefix='resolver')
+		self.pending_lookups: set = set()
+		self.selector = selectors.DefaultSelector()
+		self.dispatcher: Thread = None
+		self.dispatcher_stop = Event()
+		self.site_networks: dict = config.MONITORING_SITE_NETWORKS
+		self.monitoring_networks: frozenset = config.MONITORING_NETWORKS
+		self.sites_resolved_at = time.monotonic()
 
 	def get_hostname_from_ip(self, ip_address: str) -> str:
 		"""
-		Get hostname by ip address
+		Get hostname by ip address. Never blocks on DNS: on a cache miss the lookup
+		is started in the background and N/A is returned until it completes. An expired
+		hostname is returned while its background lookup refreshes it.
 
 		:param ip_address: IP Address of server for resolving hostname
 
 		:return: Hostname or N/A
 		"""
-		try:
-			hostname, aliaslist, ipaddrlist = socket.gethostbyaddr(ip_address)
+		hostname = HOSTNAME_CACHE.get(ip_address)
+
+		if hostname is not None:
 			return hostname
-		except socket.herror as e:
-			self.logger.log(f'Error resolving hostname for IP Address {ip_address}: {e}', 'warning')
+
+		if ipaddress.ip_address(ip_address).is_private:
+			HOSTNAME_CACHE.put(ip_address, "N/A")
 			return "N/A"
 
-	def traffic_logging(self, process_data: dict) -> None:
+		if ip_address not in self.pending_lookups:
+			self.pending_lookups.add(ip_address)
+			future = self.resolver.submit(resolve_hostname, ip_address)
+			future.add_done_callback(lambda _: self.pending_lookups.discard(ip_address))
+
+		return HOSTNAME_CACHE.get_stale(ip_address) or "N/A"
+
+	def refresh_monitoring_networks(self) -> None:
 		"""
-		Method for traffic logging.
+		Resolve the monitoring sites again once SITES_RESOLVE_INTERVAL has passed,
+		and restart the capture if their networks have changed
+		"""
+		if time.monotonic() - self.sites_resolved_at < SITES_RESOLVE_INTERVAL:
+			return
+
+		self.sites_resolved_at = time.monotonic()
+		self.site_networks = resolve_monitoring_sites(self.config.MONITORING_SITES, self.site_networks)
+		networks = frozenset().union(*self.site_networks.values())
+
+		if networks == self.monitoring_networks:
+			return
 
-		:param process_data: Dictionary with process, user virtual ip, user real ip and user uuid
+		self.logger.log(f'Monitoring networks changed: {", ".join(sorted(str(network) for network in networks))}', 'info')
+		self.monitoring_networks = networks
+		self.restart_capture()
+
+	def build_tcpdump_filter(self) -> str:
 		"""
-		process = process_data['process']
-		
-		while True:
+		Build tcpdump filter expression for all monitored users and monitoring sites
+
+		:return: tcpdump filter expression
+		"""
+		users_filter = ' or '.join(f'src {virtual_ip}' for virtual_ip in self.users_by_virtual_ip)
+		if not self.config.MONITORING_SITES:
+			return users_filter
+
+		sites_filter = ' or '.join(sorted(f'net {network}' for network in self.monitoring_networks))
+
+		return f'({users_filter}) and ({sites_filter})'
+
+	def handle_packet(self, output: bytes) -> None:
+		"""
+		Log a website visit for one line of tcpdump output
+
+		:param output: Line of tcpdump output
+		"""
+		match = TCPDUMP_PACKET_RE.match(output)
+		if match is None:
+			return
+
+		source, website = match.group(1).decode('ascii'), match.group(2).decode('ascii')
+		user = self.users_by_virtual_ip.get(source)
+
+		if user is None or website == user['virtual_ip']:
+			return
+
+		hostname = self.get_hostname_from_ip(website)
+		msg(f'Traffic detected {user["uuid"]}: {user["virtual_ip"]}/{user["real_ip"]} -> {hostname} ({website})', 'debug')
+		self.traffic_logger.log_website_visit(user['real_ip'], user['virtual_ip'], user['uuid'], f'{website}/{hostname}')
+
+	def read_capture(self, key: selectors.SelectorKey) -> list:
+		"""
+		Read available tcpdump output of a capture
+
+		:param key: Selector key of the capture stdout (its data is the capture)
+
+		:return: Complete lines of tcpdump output
+		"""
+		with self.capture_lock:
+			capture = key.data
+
+			# The capture may have been stopped after the selector reported it
+			if capture is not self.capture:
+				return []
+
+			chunk = os.read(key.fd, 1 << 16)
+
+			if not chunk:
+				self.selector.unregister(key.fileobj)
+				self.logger.log('Traffic monitoring process closed its output', 'warning')
+				return []
+
+			lines = (capture['pending'] + chunk).split(b'\n')
+			capture['pending'] = lines.pop()
+
+		return lines
+
+	def traffic_logging(self) -> None:
+		"""
+		Method for traffic logging. Runs in the dispatcher thread and handles
+		the output of every capture registered in the selector.
+		"""
+		while not self.dispatcher_stop.is_set():
 			try:
-				output = process.stdout.readline()
-
-				output = output.decode()
-				print(output)
-
-				try:
-					website = output.split(' ')[4].split('.')
-					website = '.'.join(website[:-1]).strip()
-				except Exception:
-					continue
-					
-				if website == process_data['virtual_ip']:
-					continue
-
-				print(f'Traffic detected {process_data["uuid"]}: {process_data["virtual_ip"]}/{process_data["real_ip"]} -> {self.get_hostname_from_ip(website)} ({self.get_hostname_from_ip(website)})')
-				TrafficMonitorLogger.log_website_visit(self.config.TRAFFIC_LOG, process_data['real_ip'], process_data['virtual_ip'], process_data['uuid'], f'{website}/{self.get_hostname_from_ip(website)}')
+				events = self.selector.select(timeout=CAPTURE_POLL_INTERVAL)
+
+				for key, _ in events:
+					for output in self.read_capture(key):
+						self.handle_packet(output)
 			except Exception as ex:
 				ThreadException('Error occurred during the operation of the traffic logging thread (uncritical, but atypical)', f'Error: {ex}', ExceptionLevel.EXCEPTION_WARNING_LEVEL)
-				return
 
-	def monitor_user_traffic(self, user_uuid: str, real_ip: str, virtual_ip: str) -> None:
+	def start_dispatcher(self) -> None:
 		"""
-		Start monitoring user traffic
+		Start the traffic logging dispatcher thread if it is not running yet
+		"""
+		if self.dispatcher is not None and self.dispatcher.is_alive():
+			return
 
-		:param user_uuid: User Universal Unique Identifier
-		:param real_ip: user real IP Address
-		:param virtual_ip: user virtual IP Address
+		try:
+			self.dispatcher = Thread(target=self.traffic_logging, name='capture-dispatcher', daemon=True)
+			self.dispatcher.start()
+		except Exception as ex:
+			self.logger.log(f'Warning (must be error) occurred when starting thread: {ex}', 'warning')
+		else:
+			self.logger.log('Start traffic monitoring thread successfully', 'debug')
+
+	def stop_capture(self) -> None:
+		"""
+		Stop the shared tcpdump process and unregister its output from the dispatcher
 		"""
+		if not self.capture:
+			return
+
+		process = self.capture['process']
+
+		if process.stdout.fileno() in self.selector.get_map():
+			self.selector.unregister(process.stdout)
+
 		try:
-			if real_ip in self.active_processes:
-				return
+			process.terminate()
+			process.wait(timeout=2)
+			self.logger.log('Terminated traffic monitoring process', 'debug')
+		except Exception as ex:
+			self.logger.log(f'Error occurred when terminating traffic monitoring process: {ex}', 'warning')
+			process.kill()
 
-			tcpdump_filter = f'src {virtual_ip}'
-			process = subprocess.Popen(['tcpdump', '-i', self.config.NETWORK_INTERFACE, '-U' '-n', tcpdump_filter],
-										stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-			self.logger.log(f'Executing a command to monitor network traffic: tcpdump -i {self.config.NETWORK_INTERFACE} -U -n {tcpdump_filter}', 'info')
+		process.stdout.close()
+		process.stderr.close()
 
-			if process.returncode == 1:
-				self.logger.log(f'An error occurred during the command to start the traffic monitoring process: {process.stderr}', 'error')
-				exit(1)
+		self.capture = {}
+
+	def shutdown(self) -> None:
+		"""
+		Stop monitoring traffic of all users
+		"""
+		with self.capture_lock:
+			self.active_users.clear()
+			self.users_by_virtual_ip.clear()
+			self.stop_capture()
+
+		self.dispatcher_stop.set()
+
+		if self.dispatcher is not None:
+			self.dispatcher.join(timeout=2)
+
+		self.selector.close()
+		self.resolver.shutdown(wait=False, cancel_futures=True)
+
+	def restart_capture(self) -> None:
+		"""
+		Restart the shared tcpdump process with a filter for the current set of users
+		"""
+		with self.capture_lock:
+			tcpdump_filter = self.build_tcpdump_filter() if self.users_by_virtual_ip else None
 
-			process_data = {
-				'process': process,
-				'virtual_ip': virtual_ip,
-				'uuid': user_uuid,
-				'real_ip': real_ip,
-			}
+			if self.capture and self.capture['filter'] == tcpdump_filter and self.capture['process'].poll() is None:
+				return
+
+			self.stop_capture()
+
+			if tcpdump_filter is None:
+				return
 
 			try:
-				thread_monitor = Thread(target=self.traffic_logging, args=(process_data,))
-				thread_monitor.start()
-				thread_monitor.join()
+				process = subprocess.Popen(['tcpdump', '-i', self.config.NETWORK_INTERFACE, '-U', '-l', '-n', tcpdump_filter],
+											stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+				self.logger.log(f'Executing a command to monitor network traffic: tcpdump -i {self.config.NETWORK_INTERFACE} -U -l -n {tcpdump_filter}', 'info')
+
+				if process.returncode == 1:
+					self.logger.log(f'An error occurred during the command to start the traffic monitoring process: {process.stderr}', 'error')
+					exit(1)
+
+				self.capture = {'process': process, 'filter': tcpdump_filter, 'pending': b''}
+				self.selector.register(process.stdout, selectors.EVENT_READ, self.capture)
+				self.start_dispatcher()
 			except Exception as ex:
-				self.logger.log(f'Warning (must be error) occurred when starting thread: {ex}', 'warning')
-			else:
-				self.logger.log(f'Start user traffic monitoring thread ({user_uuid}) successfully', 'debug')
+				self.logger.log(f'Error occurred when start traffic monitoring process: {ex}', 'error')
 
-			process_data['thread'] = thread_monitor
-			self.active_processes[real_ip] = process_data
-		except Exception as ex:
-			self.logger.log(f'Error occurred when start monitor user traffic thread: {ex}', 'error')
+	def monitor_user_traffic(self, user_uuid: str, real_ip: str, virtual_ip: str, restart: bool=True) -> None:
+		"""
+		Start monitoring user traffic
+
+		:param user_uuid: User Universal Unique Identifier
+		:param real_ip: user real IP Address
+		:param virtual_ip: user virtual IP Address
+		:param restart: Restart the capture right away (pass False to batch several changes)
+		"""
+		if real_ip in self.active_users:
+			return
+
+		user_data = {
+			'virtual_ip': virtual_ip,
+			'uuid': user_uuid,
+			'real_ip': real_ip,
+		}
 
-		return
+		self.active_users[real_ip] = user_data
+		self.users_by_virtual_ip[virtual_ip] = user_data
 
-	def stop_user_traffic_monitoring(self, user_ip: str) -> None:
+		if restart:
+			self.restart_capture()
+
+	def stop_user_traffic_monitoring(self, user_ip: str, restart: bool=True) -> None:
 		"""
 		Stop monitoring user traffic.
 
 		:param user_ip: User Real IP Address
+		:param restart: Restart the capture right away (pass False to batch several changes)
 		"""
-		if user_ip in self.active_processes:
+		if user_ip in self.active_users:
 			try:
 				self.logger.log(f'Stop user traffic monitoring: {user_ip}', 'info')
-				# process = self.active_processes[user_ip]['process']
-				# process.terminate()
-				# self.logger.log(f'Terminated user traffic monitoring process ({user_ip})', 'debug')
-				# thread = self.active_processes[user_ip]['thread']
-				# thread.stop()
-				# self.logger.log(f'Stopped user traffic monitoring thread ({user_ip})', 'debug')
-				del self.active_processes[user_ip]
+				user_data = self.active_users.pop(user_ip)
+				self.users_by_virtual_ip.pop(user_data['virtual_ip'], None)
+				self.traffic_logger.flush()
+
+				if restart:
+					self.restart_capture()
 			except Exception as ex:
 				self.logger.log(f'Error occurred when stopping user traffic monitoring: {ex}', 'warning')
 
@@ -329,6 +759,12 @@ class OpenVPNUserManager:
 		self.config: Config = config
 		self.users_data: dict = {}
 		self.logger: PlainLogger = plain_logger
+		self.users_file_mtime: int = None
+		self.users_file_data: dict = {}
+		self.merged_users_file_data: dict = None
+		self.status_file_mtime: int = None
+		self.status_users: list = []
+		self.monitored_users: list = None
 
 	def parse_openvpn_users(self) -> list:
 		"""
@@ -336,16 +772,31 @@ class OpenVPNUserManager:
 
 		:return: List of users
 		"""
-		lines = []
-		result = []
 		users = []
-		include = False
+
+		# The status file is rewritten by OpenVPN periodically, reuse the last result until it changes
+		try:
+			status_file_mtime = os.stat(self.config.OPENVPN_STATUS_FILE).st_mtime_ns
+		except OSError:
+			status_file_mtime = None
+
+		if status_file_mtime is not None and status_file_mtime == self.status_file_mtime:
+			return self.status_users
 
 		try:
 			try:
-				with open(self.config.OPENVPN_STATUS_FILE, 'r') as file:
-					for line in file.read().strip().split('\n'):
-						lines.append(line)
+				with open(self.config.OPENVPN_STATUS_FILE, 'r', newline='') as file:
+					# Skip everything up to the routing table without tokenizing it
+					for line in file:
+						if line.rstrip('\r\n') == STATUS_CLIENT_LIST_HEADER:
+							break
+
+					for row in csv.reader(file):
+						if row == STATUS_CLIENT_LIST_END:
+							break
+
+						row[2] = row[2].partition(':')[0]
+						users.append(row)
 			except FileNotFoundError as ex:
 				self.logger.log(f'File not found: {self.config.OPENVPN_STATUS_FILE}', 'error')
 				IOException('Error occured when parsing openvpn users', f"OpenVpn status file: {self.config.OPENVPN_STATUS_FILE}. Error: {ex}", ExceptionLevel.EXCEPTION_ERROR_LEVEL)
@@ -354,23 +805,11 @@ class OpenVPNUserManager:
 				self.logger.log(f'Permission error: {self.config.OPENVPN_STATUS_FILE}', 'error')
 				exit(1)
 
-			for line in lines:
-				if line == "Virtual Address,Common Name,Real Address,Last Ref":
-					include = True
-					continue
-
-				if include:
-					if line == "GLOBAL STATS":
-						include = False
-						continue
-					line = line.replace(line.split(',')[2], line.split(',')[2].split(':')[0])
-					result.append(line)
-
-			for res_i in result:
-				users.append([user for user in res_i.split(',')])
-
 			if len(users) == 0:
-				print('No users active...')
+				self.logger.log('No users active...', 'debug')
+
+			self.status_file_mtime = status_file_mtime
+			self.status_users = users
 
 			return users
 		except Exception as ex:
@@ -390,39 +829,133 @@ class OpenVPNUserManager:
 		if users is None:
 			users = self.parse_openvpn_users()
 
+		data = self.merge_users_data()
+
 		for user in users:
-			self.users_data[user[2]] = {
-				'uuid': str(uuid.uuid4()),
-				'virtual_ip': user[0],
-				'real_ip': user[2],
-				'common_name': user[1]
-			}
+			entry = self.users_data.get(user[2])
+
+			if entry is None:
+				self.users_data[user[2]] = {
+					'uuid': str(uuid.uuid4()),
+					'virtual_ip': user[0],
+					'real_ip': user[2],
+					'common_name': user[1]
+				}
+			else:
+				entry['virtual_ip'] = user[0]
+				entry['common_name'] = user[1]
 
-			try:
-				if len(self.users_data) > 0:
-					data = {}
-					try:
-						with open(self.config.USERS_JSON_FILE, 'r') as f:
-							data = json.load(f)
-					except ValueError:
-						continue
-					
-					self.users_data.update(data)
+		# An unreadable users file is kept as is, it may hold uuids that must not be lost
+		if len(self.users_data) == 0 or data is None:
+			return self.users_data
 
-					with open(self.config.USERS_JSON_FILE, 'w') as f:
-						json.dump(self.users_data, f, indent=4)
-			except IOError:
-				self.logger.log(f'Error: Could not write to {self.config.USERS_JSON_FILE}', 'error')
-			except Exception as ex:
-				self.logger.log(f'Could not write to {self.config.USERS_JSON_FILE}: {ex}', 'error')
+		# Skip the write when the file already holds exactly this data
+		if self.users_data != data:
+			self.save_users_data()
 
 		return self.users_data
 
+	def merge_users_data(self) -> dict:
+		"""
+		Take users stored in the users JSON file (with their uuids, also the ones added
+		or deleted with --add and --delete). When the file has changed on disk, users data
+		is rebuilt from it. Entries are copied because they are updated in place, while
+		the file snapshot is kept for comparison.
+
+		:return: Users data stored in the file (None if the file exists but can not be read)
+		"""
+		data = self.load_users_data()
+
+		if data is not None and data is not self.merged_users_file_data:
+			self.users_data = {real_ip: dict(user) for real_ip, user in data.items()}
+			self.merged_users_file_data = data
+
+		return data
+
+	def load_users_data(self) -> dict:
+		"""
+		Read users data from the users JSON file. The file is read only if it has been
+		modified since the last read or write, otherwise the known contents are returned.
+
+		:return: Users data stored in the file (None if the file exists but can not be read)
+		"""
+		try:
+			users_file_mtime = os.stat(self.config.USERS_JSON_FILE).st_mtime_ns
+		except OSError:
+			users_file_mtime = None
+
+		if users_file_mtime is not None and users_file_mtime == self.users_file_mtime:
+			return self.users_file_data
+
+		data = {}
+
+		try:
+			with open(self.config.USERS_JSON_FILE, 'r') as f:
+				data = json.load(f)
+		except FileNotFoundError:
+			pass
+		except ValueError as ex:
+			self.logger.log(f'Users file {self.config.USERS_JSON_FILE} is not valid JSON, it will not be overwritten: {ex}', 'error')
+			data = None
+		except Exception as ex:
+			self.logger.log(f'Could not read {self.config.USERS_JSON_FILE}: {ex}', 'error')
+			data = None
+
+		self.users_file_mtime = users_file_mtime
+		self.users_file_data = data
+
+		return data
+
+	def save_users_data(self) -> bool:
+		"""
+		Atomically write users data to the users JSON file
+
+		:return: True if the file has been written
+		"""
+		users_file = Path(self.config.USERS_JSON_FILE)
+		temp_filepath = None
+
+		# The temporary file is created as 0600, the users file keeps its own permissions
+		try:
+			users_file_mode = stat.S_IMODE(os.stat(users_file).st_mode)
+		except FileNotFoundError:
+			users_file_mode = USERS_FILE_MODE
+
+		try:
+			with tempfile.NamedTemporaryFile('wb', dir=users_file.parent, prefix=f'.{users_file.name}.', delete=False) as f:
+				temp_filepath = f.name
+				f.write(dump_json(self.users_data))
+
+			os.chmod(temp_filepath, users_file_mode)
+			os.replace(temp_filepath, users_file)
+
+			self.users_file_mtime = os.stat(users_file).st_mtime_ns
+			self.users_file_data = {real_ip: dict(user) for real_ip, user in self.users_data.items()}
+			self.merged_users_file_data = self.users_file_data
+		except IOError:
+			self.logger.log(f'Error: Could not write to {self.config.USERS_JSON_FILE}', 'error')
+		except Exception as ex:
+			self.logger.log(f'Could not write to {self.config.USERS_JSON_FILE}: {ex}', 'error')
+		else:
+			return True
+
+		if temp_filepath is not None:
+			Path(temp_filepath).unlink(missing_ok=True)
+
+		return False
+
 	def update_user_monitoring(self) -> None:
 		"""
 		Update the tcpdump monitoring for users
 		"""
+		self.tcpdump_manager.refresh_monitoring_networks()
+
 		users_list = self.parse_openvpn_users() # list[list] of users
+
+		if users_list is self.monitored_users:
+			return
+
+		self.monitored_users = users_list
 		users_data = self.update_user_data(users_list) # dict of users
 
 		for user in users_list:
@@ -432,27 +965,33 @@ class OpenVPNUserManager:
 				# common_name = users_data[real_ip]['common_name']
 				user_uuid = users_data[real_ip]['uuid']
 
-				if real_ip in self.tcpdump_manager.active_processes:
-					continue
-				thr = Thread(target=self.tcpdump_manager.monitor_user_traffic, args=(user_uuid, real_ip, virtual_ip))
-				thr.start()
-				thr.join()
+				active_user = self.tcpdump_manager.active_users.get(real_ip)
+
+				if active_user is not None:
+					if active_user['virtual_ip'] == virtual_ip and active_user['uuid'] == user_uuid:
+						continue
+
+					# Reconnected with another virtual IP (or re-added with --add): monitor the new address
+					self.tcpdump_manager.stop_user_traffic_monitoring(real_ip, restart=False)
+
+				self.tcpdump_manager.monitor_user_traffic(user_uuid, real_ip, virtual_ip, restart=False)
 				self.logger.log(f'Monitor user traffic: {user_uuid}')
 			except Exception as ex:
-				self.logger.log(f'Error when start active user monitoring threads: {ex}', 'error')
+				self.logger.log(f'Error when start active user monitoring: {ex}', 'error')
 				exit(1)
 
+		current_ips = {user[2] for user in users_list}
+
 		try:
-			for user in users_list:
-				try:
-					data = self.tcpdump_manager.active_processes[user[2]]
-					self.logger.log(f'User connected ({data["uuid"]}): {data["virtual_ip"]}/{data["real_ip"]}')
-				except KeyError:
-					self.tcpdump_manager.stop_user_traffic_monitoring(user[2])
+			for real_ip in self.tcpdump_manager.active_users.keys() - current_ips:
+				self.logger.log(f'User disconnected: {real_ip}')
+				self.tcpdump_manager.stop_user_traffic_monitoring(real_ip, restart=False)
 		except Exception as ex:
-			self.logger.log(f'Error when stop inactive user monitoring threads: {ex}', 'error')
+			self.logger.log(f'Error when stop inactive user monitoring: {ex}', 'error')
 			exit(1)
 
+		# Apply all changes of this pass with a single restart of tcpdump
+		self.tcpdump_manager.restart_capture()
 
 	def add_user(self, real_ip: str, virtual_ip: str, common_name: str) -> None:
 		"""
@@ -463,6 +1002,9 @@ class OpenVPNUserManager:
 		:param virtual_ip: user virtual IP Address
 		:param common_name: common name of client .ovpn config
 		"""
+		if self.merge_users_data() is None:
+			return
+
 		self.users_data[real_ip] = {
 			'uuid': str(uuid.uuid4()),
 			'virtual_ip': virtual_ip,
@@ -470,12 +1012,7 @@ class OpenVPNUserManager:
 			'common_name': common_name
 		}
 
-		try:
-			with open(self.config.USERS_JSON_FILE, 'w') as f:
-				json.dump(self.users_data, f, indent=4)
-		except IOError:
-			self.logger.log(f'Error: Could not write to {self.config.USERS_JSON_FILE}', 'error')
-		else:
+		if self.save_users_data():
 			self.logger.log(f'User {real_ip}/{virtual_ip} has been created', 'debug')
 
 	def delete_user(self, real_ip: str) -> None:
@@ -484,22 +1021,27 @@ class OpenVPNUserManager:
 
 		:param real_ip: user real ip address
 		"""
+		if self.merge_users_data() is None:
+			return
+
 		if real_ip in self.users_data:
 			self.logger.log(f'User {real_ip} has been deleted', 'debug')
 			self.tcpdump_manager.stop_user_traffic_monitoring(real_ip)
 			del self.users_data[real_ip]
+			self.save_users_data()
 
-			try:
-				with open(self.config.USERS_JSON_FILE, 'w') as f:
-					json.dump(self.users_data, f, indent=4)
-			except IOError:
-				self.logger.log(f'Error: Could not write to {self.config.USERS_JSON_FILE}', 'error')
 
+def update_user_monitoring_loop(openvpn_user_manager: OpenVPNUserManager, logger: PlainLogger):
+	"""
+	Run OpenVPNUserManager.update_user_monitoring in a loop
 
-def update_user_data_loop():
+	:param openvpn_user_manager: OpenVPN User Manager object
+	:param logger: Plain Logger object
+	"""
 	while True:
 		try:
-			openvpn_user_manager.update_user_data()
+			openvpn_user_manager.update_user_monitoring()
+			time.sleep(STATUS_POLL_INTERVAL)
 		except KeyboardInterrupt:
 			print('[yellow]Get KeyboardInterrupt: stop...[/yellow]')
 			break
@@ -508,16 +1050,15 @@ def update_user_data_loop():
 			break
 
 
-def update_user_monitoring_loop():
-	while True:
-		try:
-			openvpn_user_manager.update_user_monitoring()
-		except KeyboardInterrupt:
-			print('[yellow]Get KeyboardInterrupt: stop...[/yellow]')
-			break
-		except Exception as ex:
-			logger.log(f'Error: {ex}', 'error')
-			break
+def handle_sigterm(signum: int, frame) -> None:
+	"""
+	Turn SIGTERM (systemctl stop) into SystemExit, so the capture is stopped and
+	buffered traffic log entries are flushed like on KeyboardInterrupt
+
+	:param signum: Signal number
+	:param frame: Current stack frame
+	"""
+	raise SystemExit(0)
 
 
 def main():
@@ -530,12 +1071,16 @@ def main():
 	parser.add_argument('--config', default='/root/ovpn-traffic-monitor/config.ini', help='Path to the configuration file')
 	parser.add_argument('--add', nargs=3, metavar=('REAL_IP', 'VIRTUAL_IP', 'COMMON_NAME'), help='Add a new user')
 	parser.add_argument('--delete', metavar='REAL_IP', help='Delete an existing user')
+	parser.add_argument('--verbose', action='store_true', help='Show and log debug messages')
 
 	args = parser.parse_args()
 
+	log_level = logging.DEBUG if args.verbose else logging.INFO
+	LOGGER.setLevel(log_level)
+
 	msg('Load Config Module...', 'debug')
 	try:
-		config = Config(args.config)
+		config = get_config(args.config)
 	except Exception as ex:
 		ClassObjectException('Fail to load config module', f'Error: {ex}', ExceptionLevel.EXCEPTION_CRITICAL_LEVEL)
 		exit(1)
@@ -544,18 +1089,30 @@ def main():
 
 	msg('Load PlainLogger module...', 'debug')
 	try:
-		logger = PlainLogger(config.LOG_FILEPATH, config.LOG_FORMAT)
+		logger = PlainLogger(config.LOG_FILEPATH, config.LOG_FORMAT, log_level)
 	except Exception as ex:
 		ClassObjectException('Fail to load PlainLogger module', f'Error: {ex}', ExceptionLevel.EXCEPTION_CRITICAL_LEVEL)
 		exit(1)
 	else:
 		msg('Successfully load Config Module!', 'info')
 
-	logger.log(f'Config: {args.config}', 'debug')
+	if logger.get_logger().isEnabledFor(logging.DEBUG):
+		config_values = ', '.join(f'{key}={value}' for key, value in vars(config).items() if key.isupper())
+		logger.log(f'Config {args.config}: {config_values}', 'debug')
+
+	logger.log('Load Traffic Monitor Logger module...', 'debug')
+	try:
+		traffic_logger = TrafficMonitorLogger(config.TRAFFIC_LOG)
+	except Exception as ex:
+		ClassObjectException('Fail to load Traffic Monitor Logger module', f'Error: {ex}', ExceptionLevel.EXCEPTION_CRITICAL_LEVEL)
+		logger.log(f'Fail to load Traffic Monitor Logger module: {ex}', 'error')
+		exit(1)
+	else:
+		logger.log('Successfully load Traffic Monitor Logger Module!', 'info')
 
 	logger.log('Load TCPDump Manager module...', 'debug')
 	try:
-		tcpdump_manager = TCPDumpManager(logger, config)
+		tcpdump_manager = TCPDumpManager(logger, config, traffic_logger)
 	except Exception as ex:
 		ClassObjectException('Fail to load TCPDump Manager module', f'Error: {ex}', ExceptionLevel.EXCEPTION_CRITICAL_LEVEL)
 		logger.log(f'Fail to load TCPDump Manager module: {ex}', 'error')
@@ -581,15 +1138,6 @@ def main():
 		openvpn_user_manager.delete_user(args.delete)
 		exit(1)
 
-	logger.log('Initial update user data', 'debug')
-	try:
-		openvpn_user_manager.update_user_data()
-	except Exception as ex:
-		logger.log(f'Error occurred when update user data: {ex} ', 'error')
-		exit(1)
-	else:
-		logger.log('Successfully updated!', 'info')
-
 	logger.log('Initial update user monitoring', 'debug')
 	try:
 		openvpn_user_manager.update_user_monitoring()
@@ -599,15 +1147,15 @@ def main():
 	else:
 		logger.log('Successfully updated!', 'info')
 
-	logger.log('Start program loop...', 'debug')
-	thr = Thread(target=update_user_data_loop)
-	thr2 = Thread(target=update_user_monitoring_loop)
+	signal.signal(signal.SIGTERM, handle_sigterm)
 
-	thr.start()
-	thr2.start()
+	logger.log('Start program loop...', 'debug')
+	try:
+		update_user_monitoring_loop(openvpn_user_manager, logger)
+	finally:
+		tcpdump_manager.shutdown()
+		traffic_logger.close()
 
-	thr.join()
-	thr2.join()
 	logger.log('Stop program loop...', 'debug')
 
 